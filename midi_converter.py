@@ -1,6 +1,10 @@
 import os
 import click
+import ctypes
+import itertools
 import json
+import operator
+import struct
 import subprocess
 from rich import print
 from rich.prompt import Prompt
@@ -48,10 +52,31 @@ class MidiMetaEvent:
         self.data = data
 
 
+def build_piano_key_table(scale: str) -> tuple:
+    """
+    Строит таблицу соответствия "байт ноты -> символ виртуального пианино" для всех 256 значений байта.
+    """
+    table = []
+    for key in range(256):
+        mapped_key = key - 36  # Смещаем ноту на 3 октавы вниз, чтобы привести её в диапазон виртуального пианино
+        while mapped_key >= len(scale):
+            mapped_key -= 12  # Если нота выше допустимого диапазона, смещаем её на октаву вниз
+        while mapped_key < 0:
+            mapped_key += 12  # Если нота ниже допустимого диапазона, смещаем её на октаву вверх
+        table.append(scale[mapped_key])
+    return tuple(table)
+
+
 class MidiFile:
     HEADER_OFFSET = 23
     DEFAULT_TEMPO = 120
     VIRTUAL_PIANO_SCALE = "zZxXcvVbBnNmaAsSdfFgGhHjqQwWerRtTyYuqQwWerRtTyYuqQwWerRtTyYu))"
+    KEY_TO_PIANO = build_piano_key_table(VIRTUAL_PIANO_SCALE)
+    # Число байт данных события трека по старшему полубайту статуса (таблица вместо цепочки сравнений)
+    VOICE_DATA_BYTES = tuple(MidiTrackEvent.TYPE_BYTES.get(high, 1) for high in range(16))
+    # Заранее скомпилированные форматы для целых фиксированного размера (big-endian)
+    UINT16 = struct.Struct(">H")
+    UINT32 = struct.Struct(">I")
     
     TYPE_DICT = {
         0x00: "Sequence Number",
@@ -78,7 +103,11 @@ class MidiFile:
 
     def __init__(self, filename: str, default_tempo: int = 120):
         self.filename = filename
-        self.bytes = bytearray(open(filename, "rb").read())
+        # Читаем файл целиком одним системным вызовом, без промежуточного буфера и копии в bytearray
+        with open(filename, "rb", buffering=0) as midi_file:
+            self.bytes = midi_file.read()
+        # Срезы берём через memoryview, чтобы не копировать байты
+        self.mv = memoryview(self.bytes)
         self.header_length = -1
         self.format = -1
         self.tracks = -1
@@ -89,23 +118,14 @@ class MidiFile:
         self.running_status = -1
         self.running_status_set = False
         self.delta_time = 0
+        # Ноты храним в двух параллельных списках (время, символ) вместо списка пар;
+        # в self.notes попадают уже объединённые аккорды после process_notes
+        self.note_times = []
+        self.note_keys = []
         self.notes = []
 
-        self.start_sequence = [
-            [0x4D, 0x54, 0x68, 0x64],  # MThd
-            [0x4D, 0x54, 0x72, 0x6B],  # MTrk
-            [0xFF]  # FF
-        ]
-        self.start_counter = [0] * len(self.start_sequence)
-
         self.read_events()
 
-    def check_start_sequence(self) -> bool:
-        """
-        Проверяет, начинается ли текущая последовательность байтов с определенной стартовой последовательности (MThd, MTrk или FF).
-        """
-        return any(len(seq) == count for seq, count in zip(self.start_sequence, self.start_counter))
-
     def skip(self, i: int):
         self.itr += i
 
@@ -115,17 +135,17 @@ class MidiFile:
 
         MIDI использует "Variable Length Quantity" (VLQ), где старший бит каждого байта указывает на продолжение.
         """
-        cont_flag = True
-        length = 0
-        while cont_flag:
-            if (self.bytes[self.itr] & 0x80) >> 7 == 0x1:
-                # Если старший бит установлен, продолжаем чтение
-                length = (length << 7) + (self.bytes[self.itr] & 0x7F)
-            else:
-                # Если старший бит не установлен, это последний байт длины
-                cont_flag = False
-                length = (length << 7) + (self.bytes[self.itr] & 0x7F)
-            self.itr += 1
+        data = self.bytes
+        itr = self.itr
+        byte = data[itr]
+        itr += 1
+        length = byte & 0x7F
+        while byte & 0x80:
+            # Если старший бит установлен, продолжаем чтение
+            byte = data[itr]
+            itr += 1
+            length = (length << 7) | (byte & 0x7F)
+        self.itr = itr
         return length
 
     def read_mtrk(self):
@@ -143,7 +163,7 @@ class MidiFile:
         self.division = div & 0x7FFF
 
     def read_text(self, length: int) -> str:
-        text = "".join(chr(self.bytes[i]) for i in range(self.itr, self.itr + length))
+        text = bytes(self.mv[self.itr:self.itr + length]).decode("latin-1")
         self.itr += length
         return text
 
@@ -151,103 +171,108 @@ class MidiFile:
         event_type = self.bytes[self.itr]
         self.itr += 1
         length = self.read_length()
-        
-        event_name = self.TYPE_DICT.get(event_type, f"Неизвестное событие {event_type}")
+        end = self.itr + length
+
         if event_type == 0x2F:
             # Конец трека
-            self.itr += 2
             return False
-        elif event_type in [0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0C]:
-            # Обработка текстовых событий (например, название трека, текст, метки и т.д.)
-            pass
-        elif event_type == 0x51:
+        if event_type == 0x51:
             self.tempo = round(self.get_int(3) * 0.00024)
-        else:
-            self.itr += length
+        # Все остальные мета-события (текстовые, подпись такта и т.д.) пропускаем по их длине
+        self.itr = end
         return True
 
     def read_midi_track_event(self, length: int):
-        start = self.itr
+        end = self.itr + length
         continue_flag = True
-        while length > self.itr - start and continue_flag:
-            delta_t = self.read_length()
+        data = self.bytes
+        read_voice_event = self.read_voice_event
+        while self.itr < end and continue_flag:
+            itr = self.itr
+            delta_t = data[itr]
+            if delta_t < 0x80:
+                # Однобайтовое дельта-время — самый частый случай, обходимся без вызова read_length
+                itr += 1
+                self.itr = itr
+            else:
+                delta_t = self.read_length()
+                itr = self.itr
             self.delta_time += delta_t
-            if self.bytes[self.itr] == 0xFF:
+
+            status = data[itr]
+            if status == 0xFF:
                 # Мета-событие
-                self.itr += 1
+                self.itr = itr + 1
                 continue_flag = self.read_midi_meta_event(delta_t)
-            elif 0xF0 <= self.bytes[self.itr] <= 0xF7:
+            elif 0xF0 <= status <= 0xF7:
                 # Системное событие (сбрасывает состояние running status)
                 self.running_status_set = False
                 self.running_status = -1
             else:
                 # Событие трека (например, нажатие клавиши)
-                self.read_voice_event(delta_t)
-        self.itr = start + length
+                read_voice_event(delta_t)
+        self.itr = end
 
     def read_voice_event(self, delta_t: int):
-        if self.bytes[self.itr] < 0x80 and self.running_status_set:
+        # Состояние разбора держим в локальных переменных и записываем в self.itr один раз в конце
+        data = self.bytes
+        itr = self.itr
+        event_type = data[itr]
+        if event_type < 0x80 and self.running_status_set:
             # Используем предыдущее состояние (running status)
             event_type = self.running_status
         else:
-            event_type = self.bytes[self.itr]
             if 0x80 <= event_type <= 0xF7:
                 # Обновляем running status
                 self.running_status = event_type
                 self.running_status_set = True
-            self.itr += 1
-
-        channel = event_type & 0x0F
+            itr += 1
 
-        if event_type >> 4 == 0x9:
+        high = event_type >> 4
+        if high == 0x9:
             # Нажатие клавиши
-            key = self.bytes[self.itr]
-            self.itr += 1
-            velocity = self.bytes[self.itr]
-            self.itr += 1
+            key = data[itr]
+            velocity = data[itr + 1]
+            itr += 2
 
-            mapped_key = self.map_key_to_piano(key)
             if velocity > 0:
                 # Добавляем ноту, если скорость (velocity) больше нуля
-                self.notes.append([self.delta_time / self.division, self.VIRTUAL_PIANO_SCALE[mapped_key]])
+                self.note_times.append(self.delta_time / self.division)
+                self.note_keys.append(self.KEY_TO_PIANO[key])
 
-        elif event_type >> 4 not in {0x8, 0x9, 0xA, 0xB, 0xD, 0xE}:
-            self.itr += 1
         else:
-            self.itr += 2
-
-    def map_key_to_piano(self, key: int) -> int:
-        mapped_key = key - 36  # Смещаем ноту на 3 октавы вниз, чтобы привести её в диапазон виртуального пианино
-        while mapped_key >= len(self.VIRTUAL_PIANO_SCALE):
-            mapped_key -= 12  # Если нота выше допустимого диапазона, смещаем её на октаву вниз
-        while mapped_key < 0:
-            mapped_key += 12  # Если нота ниже допустимого диапазона, смещаем её на октаву вверх
-        return mapped_key
+            itr += self.VOICE_DATA_BYTES[high]
+        self.itr = itr
 
     def read_events(self):
-        while self.itr + 1 < len(self.bytes):
-            for i in range(len(self.start_counter)):
-                self.start_counter[i] = 0
-
-            while self.itr + 1 < len(self.bytes) and not self.check_start_sequence():
-                for i in range(len(self.start_sequence)):
-                    if self.bytes[self.itr] == self.start_sequence[i][self.start_counter[i]]:
-                        self.start_counter[i] += 1
-                    else:
-                        self.start_counter[i] = 0
-
-                if self.itr + 1 < len(self.bytes):
-                    self.itr += 1
-
-                if self.start_counter[0] == 4:
-                    self.read_mthd()
-                elif self.start_counter[1] == 4:
-                    self.read_mtrk()
+        """Находит заголовок MThd и затем по очереди обрабатывает все секции MTrk."""
+        mthd = self.bytes.find(b"MThd", self.itr)
+        if mthd != -1:
+            self.itr = mthd + 4
+            self.read_mthd()
+            # Заголовок может быть длиннее стандартных 6 байт — переходим сразу к следующей секции
+            self.itr = mthd + 8 + self.header_length
+
+        while True:
+            # В корректном файле следующая секция начинается сразу после предыдущей,
+            # поэтому поиск нужен только для посторонних данных между секциями
+            if self.bytes.startswith(b"MTrk", self.itr):
+                mtrk = self.itr
+            else:
+                mtrk = self.bytes.find(b"MTrk", self.itr)
+                if mtrk == -1:
+                    break
+            self.itr = mtrk + 4
+            self.read_mtrk()
 
     def get_int(self, size: int) -> int:
-        value = 0
-        for n in self.bytes[self.itr:self.itr + size]:
-            value = (value << 8) + n
+        """Читает беззнаковое целое big-endian длиной size байт."""
+        if size == 4:
+            value, = self.UINT32.unpack_from(self.bytes, self.itr)
+        elif size == 2:
+            value, = self.UINT16.unpack_from(self.bytes, self.itr)
+        else:
+            value = int.from_bytes(self.mv[self.itr:self.itr + size], "big")
         self.itr += size
         return value
 
@@ -255,26 +280,23 @@ class MidiFile:
         return int(value + 1) if value % 1 >= 0.5 else int(value)
 
     def process_notes(self):
-        self.notes.sort()
-
-        i = 1
-        while i < len(self.notes):
-            if self.notes[i - 1][0] == self.notes[i][0]:
-                self.notes[i][1] += self.notes[i - 1][1]
-                self.notes.pop(i - 1)
-            else:
-                i += 1
+        notes = sorted(zip(self.note_times, self.note_keys))
 
-        for note in self.notes:
-            note[1] = "".join(sorted(set(note[1]), key=note[1].index))
+        # Объединяем ноты с одинаковым временем в аккорды (символы идут в обратном порядке сортировки).
+        # dict.fromkeys убирает повторяющиеся символы, сохраняя порядок первого появления
+        self.notes = [
+            [time, "".join(dict.fromkeys(reversed([note[1] for note in group])))]
+            for time, group in itertools.groupby(notes, key=operator.itemgetter(0))
+        ]
 
         song_data = {
             "tempo": self.tempo,
             "notes": self.notes
         }
 
-        with open("song.json", "w") as song_file:
-            json.dump(song_data, song_file, ensure_ascii=False, indent=4)
+        # Компактный JSON без отступов, записанный одним блоком в двоичном режиме
+        with open("song.json", "wb") as song_file:
+            song_file.write(json.dumps(song_data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
 
         self.generate_piano_sheet()
 
@@ -282,13 +304,31 @@ class MidiFile:
         offset = self.notes[0][0]
         note_count = 0
 
+        # Собираем весь нотный лист в памяти и записываем его одним вызовом
+        parts = []
+        for note in self.notes:
+            note_repr = f"[{note[1]}]" if len(note[1]) > 1 else note[1]
+            note_count += 1
+            parts.append(f"{note_repr:>7} ")
+            if note_count % 8 == 0:
+                parts.append("\n")
+
         with open("sheet.txt", "w") as midi_sheet:
-            for note in self.notes:
-                note_repr = f"[{note[1]}]" if len(note[1]) > 1 else note[1]
-                note_count += 1
-                midi_sheet.write(f"{note_repr:>7} ")
-                if note_count % 8 == 0:
-                    midi_sheet.write("\n")
+            midi_sheet.write("".join(parts))
+
+
+def needs_elevation() -> bool:
+    """
+    Проверяет, нужно ли перезапускать проигрыватель с правами администратора.
+
+    Genshin Impact работает с повышенными правами и игнорирует нажатия от обычных процессов Windows.
+    """
+    if os.name != "nt":
+        return False
+    try:
+        return not ctypes.windll.shell32.IsUserAnAdmin()
+    except (AttributeError, OSError):
+        return True
 
 
 @click.command()
@@ -330,10 +370,13 @@ def main(directory: str, default_tempo: int, play: bool):
 
     if play:
         console.print(":play_button: [bold green]Запуск воспроизведения...[/bold green]")
-        if os.name == 'nt':
+        if needs_elevation():
             subprocess.run(["powershell", "-Command", "Start-Process", "python", "-ArgumentList", "'play_song.py', '--song', 'song.json'", "-Verb", "runAs"])
         else:
-            subprocess.run(["python", "play_song.py", "--song", "song.json"])
+            # Права уже достаточные — запускаем проигрыватель в этом же процессе, без нового интерпретатора.
+            # Импорт здесь, чтобы для одной лишь конвертации не требовался модуль keyboard
+            import play_song
+            play_song.main(["--song", "song.json"])
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,10 @@
 import json
+import string
 import threading
+import time
 import click
 import keyboard
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple
 from rich.console import Console
 from rich.panel import Panel
 
@@ -21,9 +23,19 @@ conversion_cases = {
     ")": "0",
 }
 
+
+class Chord(NamedTuple):
+    offset: float  # Время начала аккорда от начала песни в секундах (при скорости 1.0)
+    duration: float
+    notes: str
+    shifted_keys: Tuple[str, ...]  # Клавиши, которые нажимаются с зажатым Shift
+    normal_keys: Tuple[str, ...]
+    release_only: bool  # Аккорд вида "~...": только отпустить клавиши
+
+
 stored_index: int = 0
 playback_speed: float = 1.0
-song_data: List[Tuple[float, str]] = []
+song_data: List[Chord] = []
 tempo: float = 1.0
 playback_thread: threading.Thread = None
 stop_event = threading.Event()
@@ -44,68 +56,104 @@ def is_shifted(char_in: str) -> bool:
     return 65 <= ascii_value <= 90 or char_in in '!@#$%^&*()_+{}|:"<>?'
 
 
-def press_letter(str_letter: str):
-    if is_shifted(str_letter):
-        if str_letter in conversion_cases:
-            str_letter = conversion_cases[str_letter]
-        keyboard.release(str_letter.lower())
+def char_info(char_in: str) -> Tuple[bool, str]:
+    """Возвращает пару (нужен ли Shift, клавиша для нажатия) для символа ноты."""
+    if is_shifted(char_in):
+        return True, conversion_cases.get(char_in, char_in).lower()
+    return False, char_in
+
+
+CHAR_INFO = {char: char_info(char) for char in string.printable + "".join(conversion_cases)}
+
+
+def split_keys(letters: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    shifted_keys = []
+    normal_keys = []
+    for letter in letters:
+        shifted, key = CHAR_INFO.get(letter) or char_info(letter)
+        if shifted:
+            shifted_keys.append(key)
+        else:
+            normal_keys.append(key)
+    return tuple(shifted_keys), tuple(normal_keys)
+
+
+def press_chord(chord: Chord):
+    for key in chord.normal_keys:
+        keyboard.release(key)
+        keyboard.press(key)
+    if chord.shifted_keys:
+        # Shift зажимается один раз на весь аккорд, а не для каждой клавиши
+        for key in chord.shifted_keys:
+            keyboard.release(key)
         keyboard.press("left shift")
-        keyboard.press(str_letter.lower())
+        for key in chord.shifted_keys:
+            keyboard.press(key)
         keyboard.release("left shift")
-    else:
-        keyboard.release(str_letter)
-        keyboard.press(str_letter)
 
 
-def release_letter(str_letter: str):
-    if is_shifted(str_letter):
-        if str_letter in conversion_cases:
-            str_letter = conversion_cases[str_letter]
-        keyboard.release(str_letter.lower())
-    else:
-        keyboard.release(str_letter)
+def release_chord(chord: Chord):
+    for key in chord.shifted_keys:
+        keyboard.release(key)
+    for key in chord.normal_keys:
+        keyboard.release(key)
 
 
 def floor_to_zero(value: float) -> float:
     return max(value, 0)
 
 
-def parse_info(notes: List[Tuple[float, str]]) -> List[Tuple[float, str]]:
+def make_chord(offset: float, duration: float, letters: str) -> Chord:
+    # Разбор клавиш выполняется один раз при загрузке, а не при каждом нажатии
+    release_only = letters[0] == "~"
+    shifted_keys, normal_keys = split_keys(letters[1:] if release_only else letters)
+    return Chord(offset, duration, letters, shifted_keys, normal_keys, release_only)
+
+
+def parse_info(notes: List[Tuple[float, str]]) -> List[Chord]:
     global tempo
 
     parsed_notes = []
+    offset = 0.0
     for i in range(len(notes) - 1):
         note_time = notes[i][0]
         next_note_time = notes[i + 1][0]
         note_duration = (next_note_time - note_time) * (60 / tempo)
-        parsed_notes.append((note_duration, notes[i][1]))
+        parsed_notes.append(make_chord(offset, note_duration, notes[i][1]))
+        offset += floor_to_zero(note_duration)
 
-    parsed_notes.append((1.0, notes[-1][1]))  # Последнюю ноту держим 1 секунду
+    parsed_notes.append(make_chord(offset, 1.0, notes[-1][1]))  # Последнюю ноту держим 1 секунду
     return parsed_notes
 
 
 def play_notes():
     global stored_index, playback_speed, song_data
 
+    # Паузы отсчитываются от общего момента старта, а не от конца предыдущего ожидания,
+    # поэтому погрешность stop_event.wait не накапливается за песню
+    start = 0.0
+    next_index = -1
     while stored_index < len(song_data) and not stop_event.is_set():
-        note_info = song_data[stored_index]
-        delay = floor_to_zero(note_info[0]) / playback_speed
-
-        if note_info[1][0] == "~":
-            for n in note_info[1][1:]:
-                release_letter(n)
+        chord = song_data[stored_index]
+        delay = floor_to_zero(chord.duration) / playback_speed
+        if stored_index != next_index:
+            # Начало воспроизведения или перемотка: заново привязываем расписание к текущему моменту
+            start = time.perf_counter() - chord.offset / playback_speed
+
+        if chord.release_only:
+            release_chord(chord)
         else:
-            for n in note_info[1]:
-                press_letter(n)
-        if "~" not in note_info[1]:
-            release_letter(n)
+            press_chord(chord)
+            release_chord(chord)
             console.print(
-                f"[cyan]{delay:10.2f}[/cyan] [bold magenta]{note_info[1]}[/bold magenta]"
+                f"[cyan]{delay:10.2f}[/cyan] [bold magenta]{chord.notes}[/bold magenta]"
             )
 
         stored_index += 1
-        if delay > 0:
-            stop_event.wait(delay)
+        next_index = stored_index
+        remaining = start + (chord.offset + floor_to_zero(chord.duration)) / playback_speed - time.perf_counter()
+        if remaining > 0:
+            stop_event.wait(remaining)
 
     if stored_index >= len(song_data):
         stored_index = 0
@@ -127,7 +175,7 @@ def skip():
 
 
 def load_song_data(filename: str) -> Tuple[float, List[Tuple[float, str]]]:
-    with open(filename, "r") as file:
+    with open(filename, "rb") as file:
         data = json.load(file)
         tempo = data.get("tempo", 120)
         notes = data.get("notes", [])
@@ -144,7 +192,9 @@ def main(song: str, speed: float):
     tempo, notes = load_song_data(song)
     song_data = parse_info(notes)
 
-    keyboard.hook(on_key_event)
+    keyboard.add_hotkey("delete", on_del_press)
+    keyboard.add_hotkey("home", rewind)
+    keyboard.add_hotkey("end", skip)
 
     panel_content = """
     [cyan bold]Воспроизведение/Пауза:[/cyan bold] [green]DELETE[/green]
@@ -169,14 +219,5 @@ def main(song: str, speed: float):
         console.print("[red bold]🚪 Завершение программы[/red bold]")
 
 
-def on_key_event(event):
-    if event.name == "delete":
-        on_del_press()
-    elif event.name == "home":
-        rewind()
-    elif event.name == "end":
-        skip()
-
-
 if __name__ == "__main__":
     main()